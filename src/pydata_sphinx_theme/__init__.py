@@ -1,23 +1,139 @@
 """Bootstrap-based sphinx theme from the PyData community."""
 
 import json
-import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from importlib import import_module
 from pathlib import Path
-from typing import Dict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.parse import urlparse
+from weakref import WeakKeyDictionary
 
-import requests
-from requests.exceptions import ConnectionError, HTTPError, RetryError
-from sphinx.application import Sphinx
+from jinja2 import Environment, TemplateError, meta
+from sphinx.application import Sphinx, TemplateBridge
 from sphinx.errors import ExtensionError
 from sphinx.util import logging
 
-from . import edit_this_page, logo, pygment, short_link, toctree, translator, utils
+from . import short_link, translator, utils
 
 __version__ = "0.14.2dev0"
 
 logger = logging.getLogger(__name__)
 
+# executor used to download the version switcher file off the main thread, in
+# serial builds only as parallel ones fork
+_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pydata-sphinx-theme")
+
+# URL schemes of the version switcher files that are downloaded
+HTTP_SCHEMES = frozenset({"http", "https"})
+
+# static file setting the version switcher metadata (relative to `_static`) and
+# the template of its content
+SWITCHER_JS_FILE = "scripts/pydata-sphinx-theme-switcher.js"
+SWITCHER_JS_TEMPLATE = (
+    "DOCUMENTATION_OPTIONS.theme_version = '{theme_version}';\n"
+    "DOCUMENTATION_OPTIONS.theme_switcher_json_url = '{json_url}';\n"
+    "DOCUMENTATION_OPTIONS.theme_switcher_version_match = '{version_match}';\n"
+)
+
+# Layout sections of the html context that are filled with a list of templates
+TEMPLATE_SECTIONS = (
+    "theme_navbar_start",
+    "theme_navbar_center",
+    "theme_navbar_persistent",
+    "theme_navbar_end",
+    "theme_article_header_start",
+    "theme_article_header_end",
+    "theme_article_footer_items",
+    "theme_content_footer_items",
+    "theme_footer_start",
+    "theme_footer_center",
+    "theme_footer_end",
+    "theme_secondary_sidebar_items",
+    "theme_primary_sidebar_end",
+    "sidebars",
+)
+
+# These templates take too long to render, so skip them.
+# They should never be empty anyway.
+SKIP_EMPTY_TEMPLATE_CHECKS = frozenset({"sidebar-nav-bs.html", "navbar-nav.html"})
+
+# longest string context value used in the key of the empty template checks
+MAX_TEMPLATE_CACHE_STRING = 1000
+
+# result of the empty template checks stored by template loader, then by template
+# name as (context variables used by the template, {context key: is empty})
+_EMPTY_TEMPLATE_CACHE: "WeakKeyDictionary[TemplateBridge, Dict[str, tuple]]" = (
+    WeakKeyDictionary()
+)
+
+# parsed local json files stored by path as ((mtime, size), content), so that
+# successive builds in the same process do not read them again
+_LOCAL_JSON_CACHE: Dict[Path, Tuple[Tuple[int, int], Any]] = {}
+
+# pending version switcher downloads, stored by application as (json_url, future).
+# Not stored on `app.env` as the environment is pickled before the build ends.
+_SWITCHER_DOWNLOADS: "WeakKeyDictionary[Sphinx, Tuple[str, Future]]" = (
+    WeakKeyDictionary()
+)
+
+
+def _load_local_json(path: Path) -> Any:
+    """Parse a local json file, reusing the previous result while it is unchanged."""
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _LOCAL_JSON_CACHE.get(path)
+    if cached is None or cached[0] != version:
+        cached = _LOCAL_JSON_CACHE[path] = (version, json.loads(path.read_bytes()))
+    return cached[1]
+
+
+def _check_switcher_json(json_url: str, load_content: Callable[[], Any]) -> None:
+    """Check the content of the version switcher file returned by ``load_content``.
+
+    Display a log warning if the file cannot be reached or is ill formed and
+    raise an error if it's not json.
+    """
+    # the exceptions of requests are subclasses of OSError, catching them that
+    # way avoids importing requests when the file is a local one. Files that
+    # cannot be decoded with their declared charset cannot be read either.
+    try:
+        switcher_content = load_content()
+    except (OSError, UnicodeError, LookupError) as e:
+        logger.warning(
+            f'The version switcher "{json_url}" file cannot be read due to the following error:\n'
+            f"{e!r}"
+        )
+        return
+
+    if any("url" not in e or "version" not in e for e in switcher_content):
+        logger.warning(
+            f'The version switcher "{json_url}" file is malformed'
+            ' at least one of the items is missing the "url" or "version" key'
+        )
+
+
+def _get_template_names(templates: Union[str, List[str]]) -> List[str]:
+    """Return the template file names of a layout section."""
+    # Break apart `,` separated strings so we can use , in the defaults
+    if isinstance(templates, str):
+        templates = [ii.strip() for ii in templates.split(",")]
+
+    # Add `.html` to templates with no suffix
+    return [
+        template if "." in template.rpartition("/")[2] else template + ".html"
+        for template in templates
+    ]
+
 
 def update_config(app):
     """Update config with new default values and handle deprecated keys."""
@@ -28,28 +144,45 @@ def update_config(app):
     theme_options = utils.get_theme_options_dict(app)
 
     # TODO: deprecation; remove after 0.14 release
-    if theme_options.get("logo_text"):
+    logo_text = theme_options.get("logo_text")
+    if logo_text:
         logo = theme_options.get("logo", {})
-        logo["text"] = theme_options.get("logo_text")
+        logo["text"] = logo_text
         theme_options["logo"] = logo
         logger.warning(
             "The configuration `logo_text` is deprecated." "Use `'logo': {'text': }`."
         )
 
     # TODO: DEPRECATE after 0.14
-    if theme_options.get("footer_items"):
-        theme_options["footer_start"] = theme_options.get("footer_items")
+    footer_items = theme_options.get("footer_items")
+    if footer_items:
+        theme_options["footer_start"] = footer_items
         logger.warning(
             "`footer_items` is deprecated. Use `footer_start` or `footer_end` instead."
         )
 
     # TODO: DEPRECATE after v0.15
-    if theme_options.get("favicons"):
+    favicons = theme_options.get("favicons")
+    if favicons:
         logger.warning(
             "The configuration `favicons` is deprecated."
             "Use the sphinx-favicon extension instead."
         )
 
+        # Add links for favicons in the topbar. They are the same for every page
+        # so they are registered once for the whole build
+        for favicon in favicons:
+            icon_type = Path(favicon["href"]).suffix.strip(".")
+            opts = {
+                "rel": favicon.get("rel", "icon"),
+                "sizes": favicon.get("sizes", "16x16"),
+                "type": f"image/{icon_type}",
+            }
+            if "color" in favicon:
+                opts["color"] = favicon["color"]
+            # Sphinx will auto-resolve href if it's a local file
+            app.add_css_file(favicon["href"], **opts)
+
     # TODO: in 0.15, set the default navigation_with_keys value to False and remove this deprecation notice
     if theme_options.get("navigation_with_keys", None) is None:
         logger.warning(
@@ -62,60 +195,91 @@ def update_config(app):
         )
         theme_options["navigation_with_keys"] = False
 
+    # Normalize the template names of the layout sections once for the whole build.
+    # `sidebars` is left out as Sphinx creates a new list for every page.
+    default_sections = {}
+    for section in TEMPLATE_SECTIONS[:-1]:
+        option = section[len("theme_") :]
+        templates = theme_options.get(option)
+        if templates is None and hasattr(app.builder, "theme"):
+            templates = app.builder.theme.get_config("options", option, None)
+        if templates:
+            default_sections[section] = _get_template_names(templates)
+            theme_options[option] = default_sections[section]
+    app.env.pst_default_sections = default_sections
+
     # Validate icon links
-    if not isinstance(theme_options.get("icon_links", []), list):
+    icon_links = theme_options.get("icon_links", [])
+    if not isinstance(icon_links, list):
         raise ExtensionError(
             "`icon_links` must be a list of dictionaries, you provided "
-            f"type {type(theme_options.get('icon_links'))}."
+            f"type {type(icon_links)}."
         )
 
+    # Remove a duplicate entry of the theme CSS. This is because it is in both:
+    # - theme.conf
+    # - manually linked in `webpack-macros.html`
+    # Sphinx copies the builder list in every page context, so it is done once here.
+    # The list is `_css_files` in Sphinx>=7.2 and `css_files` before that.
+    css_files = getattr(app.builder, "_css_files", None)
+    if css_files is None:
+        css_files = getattr(app.builder, "css_files", [])
+    theme_css_name = "_static/styles/pydata-sphinx-theme.css"
+    css_files[:] = [
+        css for css in css_files if getattr(css, "filename", css) != theme_css_name
+    ]
+
     # Set the anchor link default to be # if the user hasn't provided their own
     if not utils.config_provided_by_user(app, "html_permalinks_icon"):
         app.config.html_permalinks_icon = "#"
 
     # check the validity of the theme switcher file
-    is_dict = isinstance(theme_options.get("switcher"), dict)
+    theme_switcher = theme_options.get("switcher")
+    is_dict = isinstance(theme_switcher, dict)
     should_test = theme_options.get("check_switcher", True)
     if is_dict and should_test:
-        theme_switcher = theme_options.get("switcher")
-
         # raise an error if one of these compulsory keys is missing
         json_url = theme_switcher["json_url"]
         theme_switcher["version_match"]
 
-        # try to read the json file. If it's a url we use request,
-        # else we simply read the local file from the source directory
-        # display a log warning if the file cannot be reached
-        reading_error = None
-        if urlparse(json_url).scheme in ["http", "https"]:
-            try:
-                request = requests.get(json_url)
-                request.raise_for_status()
-                content = request.text
-            except (ConnectionError, HTTPError, RetryError) as e:
-                reading_error = repr(e)
+        # try to read the json file. If it's a url we download it in the
+        # background and only check it at the end of the build as it can only
+        # ever trigger a warning, else we simply read the local file from the
+        # source directory
+        if urlparse(json_url).scheme in HTTP_SCHEMES:
+            # the response is cached next to the doctrees so that it is shared
+            # between builders and successive builds of the same project
+            cache_file = Path(app.doctreedir, ".pst-switcher-cache.json")
+            if app.parallel > 1:
+                # parallel builds fork their workers, which is not safe while a
+                # thread may hold an import or SSL lock, so download it right away
+                _check_switcher_json(
+                    json_url,
+                    lambda: json.loads(utils.get_url_cached(json_url, cache_file)),
+                )
+            else:
+                future = _EXECUTOR.submit(utils.get_url_cached, json_url, cache_file)
+                _SWITCHER_DOWNLOADS[app] = (json_url, future)
         else:
-            try:
-                content = Path(app.srcdir, json_url).read_text()
-            except FileNotFoundError as e:
-                reading_error = repr(e)
-
-        if reading_error is not None:
-            logger.warning(
-                f'The version switcher "{json_url}" file cannot be read due to the following error:\n'
-                f"{reading_error}"
+            local_file = Path(app.srcdir, json_url)
+            _check_switcher_json(json_url, lambda: _load_local_json(local_file))
+
+    # Add the version switcher metadata to DOCUMENTATION_OPTIONS for re-use in our
+    # main JS script. It doesn't depend on the page so it is written once in a
+    # static file instead of being inlined in every page.
+    if is_dict and app.builder.format == "html":
+        switcher_js = Path(app.outdir, "_static", SWITCHER_JS_FILE)
+        switcher_js.parent.mkdir(parents=True, exist_ok=True)
+        switcher_js.write_text(
+            SWITCHER_JS_TEMPLATE.format_map(
+                {
+                    "theme_version": __version__,
+                    "json_url": theme_switcher["json_url"],
+                    "version_match": theme_switcher["version_match"],
+                }
             )
-        else:
-            # check that the json file is not illformed,
-            # throw a warning if the file is ill formed and an error if it's not json
-            switcher_content = json.loads(content)
-            missing_url = any(["url" not in e for e in switcher_content])
-            missing_version = any(["version" not in e for e in switcher_content])
-            if missing_url or missing_version:
-                logger.warning(
-                    f'The version switcher "{json_url}" file is malformed'
-                    ' at least one of the items is missing the "url" or "version" key'
-                )
+        )
+        app.add_js_file(SWITCHER_JS_FILE)
 
     # Add an analytics ID to the site if provided
     analytics = theme_options.get("analytics", {})
@@ -162,20 +326,15 @@ def update_config(app):
     ]
     # Add extra icon links entries if there were shortcuts present
     # TODO: Deprecate this at some point in the future?
-    icon_links = theme_options.get("icon_links", [])
-    for url, icon, name in shortcuts:
-        if theme_options.get(url):
-            # This defaults to an empty list so we can always insert
-            icon_links.insert(
-                0,
-                {
-                    "url": theme_options.get(url),
-                    "icon": icon,
-                    "name": name,
-                    "type": "fontawesome",
-                },
+    # Build the list once (last shortcut first) instead of inserting them one by one
+    shortcut_links = []
+    for url, icon, name in reversed(shortcuts):
+        shortcut_url = theme_options.get(url)
+        if shortcut_url:
+            shortcut_links.append(
+                {"url": shortcut_url, "icon": icon, "name": name, "type": "fontawesome"}
             )
-    theme_options["icon_links"] = icon_links
+    theme_options["icon_links"] = shortcut_links + icon_links
 
     # Prepare the logo config dictionary
     theme_logo = theme_options.get("logo")
@@ -187,96 +346,169 @@ def update_config(app):
     theme_options["logo"] = theme_logo
 
 
+def check_switcher_download(app: Sphinx, exception=None) -> None:
+    """Wait for the version switcher download started in `update_config` and check it."""
+    download = _SWITCHER_DOWNLOADS.pop(app, None)
+    if download is None or exception is not None:
+        return
+
+    json_url, future = download
+    _check_switcher_json(json_url, lambda: json.loads(future.result()))
+
+
+def _freeze(value: Any) -> Hashable:
+    """Return a hashable copy of plain json-like data, raise a TypeError otherwise.
+
+    Long strings are refused too: they are page content (e.g. ``body`` or
+    ``toc``) that would keep one cache entry, holding a copy of it, per page.
+    """
+    if type(value) is str and len(value) > MAX_TEMPLATE_CACHE_STRING:
+        raise TypeError("long strings are not used in template cache keys")
+    if value is None or type(value) in (str, int, float, bool):
+        return value
+    if type(value) in (list, tuple):
+        return tuple(_freeze(v) for v in value)
+    if type(value) is dict:
+        return tuple((_freeze(k), _freeze(v)) for k, v in value.items())
+    raise TypeError(f"{type(value)} cannot be used in a template cache key")
+
+
+def _get_template_variables(
+    environment: Environment, tname: str
+) -> Optional[FrozenSet[str]]:
+    """Return the context variables used by a template and the templates it pulls in.
+
+    Return ``None`` if this cannot be known before rendering, e.g. when a
+    template is included through a variable.
+    """
+    variables, todo, seen = set(), [tname], set()
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            source = environment.loader.get_source(environment, name)[0]
+            ast = environment.parse(source)
+        except TemplateError:
+            return None
+        variables |= meta.find_undeclared_variables(ast)
+        for referenced in meta.find_referenced_templates(ast):
+            if referenced is None:
+                return None
+            todo.append(referenced)
+
+    return frozenset(variables)
+
+
+def _is_empty_template(app: Sphinx, tname: str, context: dict) -> bool:
+    """Check if a template renders to an empty string in this page context.
+
+    Rendering a template only to discard it is costly when repeated on every
+    page so the result is cached. The cache key is made of the context values
+    the template actually uses, if one of them is not plain data (e.g. a
+    page-specific function like ``pathto``) the template is always rendered.
+    """
+    templates = app.builder.templates
+    environment = getattr(templates, "environment", None)
+
+    key = None
+    if environment is not None:
+        cache = _EMPTY_TEMPLATE_CACHE.setdefault(templates, {})
+        if tname not in cache:
+            cache[tname] = (_get_template_variables(environment, tname), {})
+        variables, results = cache[tname]
+        if variables is not None:
+            try:
+                key = tuple(
+                    (name in context, _freeze(context.get(name)))
+                    for name in sorted(variables)
+                )
+            except TypeError:
+                key = None
+        if key is not None and key in results:
+            return results[key]
+
+    # Render the template and see if it is totally empty
+    is_empty = len(templates.render(tname, context).strip()) == 0
+    if key is not None:
+        results[key] = is_empty
+
+    return is_empty
+
+
 def update_and_remove_templates(
     app: Sphinx, pagename: str, templatename: str, context, doctree
 ) -> None:
     """Update template names and assets for page build."""
-    # Allow for more flexibility in template names
-    template_sections = [
-        "theme_navbar_start",
-        "theme_navbar_center",
-        "theme_navbar_persistent",
-        "theme_navbar_end",
-        "theme_article_header_start",
-        "theme_article_header_end",
-        "theme_article_footer_items",
-        "theme_content_footer_items",
-        "theme_footer_start",
-        "theme_footer_center",
-        "theme_footer_end",
-        "theme_secondary_sidebar_items",
-        "theme_primary_sidebar_end",
-        "sidebars",
-    ]
-    for section in template_sections:
-        if context.get(section):
-            # Break apart `,` separated strings so we can use , in the defaults
-            if isinstance(context.get(section), str):
-                context[section] = [
-                    ii.strip() for ii in context.get(section).split(",")
-                ]
-
-            # Add `.html` to templates with no suffix
-            for ii, template in enumerate(context.get(section)):
-                if not os.path.splitext(template)[1]:
-                    context[section][ii] = template + ".html"
-
-            # If this is the page TOC, check if it is empty and remove it if so
-            def _remove_empty_templates(tname):
-                # These templates take too long to render, so skip them.
-                # They should never be empty anyway.
-                SKIP_EMPTY_TEMPLATE_CHECKS = ["sidebar-nav-bs.html", "navbar-nav.html"]
-                if not any(tname.endswith(temp) for temp in SKIP_EMPTY_TEMPLATE_CHECKS):
-                    # Render the template and see if it is totally empty
-                    rendered = app.builder.templates.render(tname, context)
-                    if len(rendered.strip()) == 0:
-                        return False
-                return True
-
-            context[section] = list(filter(_remove_empty_templates, context[section]))
 
-    # Remove a duplicate entry of the theme CSS. This is because it is in both:
-    # - theme.conf
-    # - manually linked in `webpack-macros.html`
-    if "css_files" in context:
-        theme_css_name = "_static/styles/pydata-sphinx-theme.css"
-        if theme_css_name in context["css_files"]:
-            context["css_files"].remove(theme_css_name)
-
-    # Add links for favicons in the topbar
-    for favicon in context.get("theme_favicons", []):
-        icon_type = Path(favicon["href"]).suffix.strip(".")
-        opts = {
-            "rel": favicon.get("rel", "icon"),
-            "sizes": favicon.get("sizes", "16x16"),
-            "type": f"image/{icon_type}",
-        }
-        if "color" in favicon:
-            opts["color"] = favicon["color"]
-        # Sphinx will auto-resolve href if it's a local file
-        app.add_css_file(favicon["href"], **opts)
+    # If this is the page TOC, check if it is empty and remove it if so
+    def _remove_empty_templates(tname):
+        if tname.rpartition("/")[2] not in SKIP_EMPTY_TEMPLATE_CHECKS:
+            return not _is_empty_template(app, tname, context)
+        return True
+
+    default_sections = app.env.pst_default_sections
+    for section in TEMPLATE_SECTIONS:
+        templates = context.get(section)
+        if not templates:
+            continue
+
+        # The defaults are already normalized in `update_config`, only the
+        # values overridden for this page need it
+        if templates is not default_sections.get(section):
+            templates = _get_template_names(templates)
+
+        context[section] = list(filter(_remove_empty_templates, templates))
 
     # Add metadata to DOCUMENTATION_OPTIONS so that we can re-use later
-    # Pagename to current page
-    app.add_js_file(None, body=f"DOCUMENTATION_OPTIONS.pagename = '{pagename}';")
+    # Pagename to current page, the rest of the switcher metadata is the same
+    # for every page and is set in the static file written by `update_config`
+    js = f"DOCUMENTATION_OPTIONS.pagename = '{pagename}';"
     if isinstance(context.get("theme_switcher"), dict):
-        theme_switcher = context["theme_switcher"]
-        json_url = theme_switcher["json_url"]
-        version_match = theme_switcher["version_match"]
+        show_banner = str(context["theme_show_version_warning_banner"]).lower()
+        js += f"\nDOCUMENTATION_OPTIONS.show_version_warning_banner = {show_banner};"
 
-        # Add variables to our JavaScript for re-use in our main JS script
-        js = f"""
-        DOCUMENTATION_OPTIONS.theme_version = '{__version__}';
-        DOCUMENTATION_OPTIONS.theme_switcher_json_url = '{json_url}';
-        DOCUMENTATION_OPTIONS.theme_switcher_version_match = '{version_match}';
-        DOCUMENTATION_OPTIONS.show_version_warning_banner = {str(context["theme_show_version_warning_banner"]).lower()};
-        """
-        app.add_js_file(None, body=js)
+    # All the metadata goes in a single inline script
+    app.add_js_file(None, body=js)
 
     # Update version number for the "made with version..." component
     context["theme_version"] = __version__
 
 
+def _lazy_handler(module: str, name: str) -> Callable:
+    """Return an event handler that imports its module the first time it is called.
+
+    Some modules pull costly dependencies (e.g. BeautifulSoup, the pygments
+    formatters) that are not needed by the builders that never emit their events.
+    """
+
+    def handler(*args, **kwargs):
+        return getattr(import_module(f".{module}", __name__), name)(*args, **kwargs)
+
+    handler.__qualname__ = f"{module}.{name}"
+    return handler
+
+
+def write_static_files(app: Sphinx, exception=None) -> None:
+    """Write the pygments CSS and copy the logo images concurrently.
+
+    These handlers are independent and mostly write files to the output
+    directory, so they can overlap. Their exceptions are raised in the main thread.
+    """
+    handlers = (
+        _lazy_handler("pygment", "overwrite_pygments_css"),
+        _lazy_handler("logo", "copy_logo_images"),
+    )
+    # the executor only lives for this handler so that no thread outlives it
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(handler, app, exception) for handler in handlers]
+
+    # both handlers have finished writing, raise the first error if any
+    for future in futures:
+        future.result()
+
+
 def setup(app: Sphinx) -> Dict[str, str]:
     """Setup the Sphinx application."""
     here = Path(__file__).parent.resolve()
@@ -288,12 +520,12 @@ def setup(app: Sphinx) -> Dict[str, str]:
 
     app.connect("builder-inited", translator.setup_translators)
     app.connect("builder-inited", update_config)
-    app.connect("html-page-context", edit_this_page.setup_edit_url)
-    app.connect("html-page-context", toctree.add_toctree_functions)
+    app.connect("html-page-context", _lazy_handler("edit_this_page", "setup_edit_url"))
+    app.connect("html-page-context", _lazy_handler("toctree", "add_toctree_functions"))
     app.connect("html-page-context", update_and_remove_templates)
-    app.connect("html-page-context", logo.setup_logo_path)
-    app.connect("build-finished", pygment.overwrite_pygments_css)
-    app.connect("build-finished", logo.copy_logo_images)
+    app.connect("html-page-context", _lazy_handler("logo", "setup_logo_path"))
+    app.connect("build-finished", write_static_files)
+    app.connect("build-finished", check_switcher_download)
 
     # https://www.sphinx-doc.org/en/master/extdev/i18n.html#extension-internationalization-i18n-and-localization-l10n-using-i18n-api
     app.add_message_catalog("sphinx", here / "locale")
@@ -1,10 +1,27 @@
 """General helpers for the management of config parameters."""
 
-from typing import Any, Dict, Iterator
+import json
+import os
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator
 
 from docutils.nodes import Node
 from sphinx.application import Sphinx
 
+if TYPE_CHECKING:
+    import requests
+
+# number of seconds during which a cached URL is served without revalidation
+URL_CACHE_TTL = 300
+
+# mode of the files created by the process, read once at import as `os.umask`
+# can only be read by setting it, which is not safe once threads are running
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 def get_theme_options_dict(app: Sphinx) -> Dict[str, Any]:
     """Return theme options for the application w/ a fallback if they don't exist.
@@ -39,3 +56,125 @@ def traverse_or_findall(node: Node, condition: str, **kwargs) -> Iterator[Node]:
         if hasattr(node, "findall")
         else node.traverse(condition, **kwargs)
     )
+
+
+@lru_cache(maxsize=None)
+def _get_session() -> "requests.Session":
+    """Return a shared HTTP session that retries transient connection failures."""
+    # requests is slow to import and only needed for remote switcher files
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _read_url_cache(cache_file: Path) -> Dict[str, Dict[str, Any]]:
+    """Read the url cache file, dropping anything that is not a valid entry.
+
+    An unreadable or malformed file is treated as an empty cache.
+    """
+    try:
+        cache = json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+
+    return {
+        url: entry
+        for url, entry in cache.items()
+        if isinstance(entry, dict)
+        and isinstance(entry.get("fetched_at"), (int, float))
+        and isinstance(entry.get("body"), str)
+        and isinstance(entry.get("etag"), (str, type(None)))
+        and isinstance(entry.get("last_modified"), (str, type(None)))
+    }
+
+
+def _write_url_cache(cache_file: Path, cache: Dict[str, Dict[str, Any]]) -> None:
+    """Write the url cache file atomically as it can be shared by several builders.
+
+    The file gets the usual permissions of the build artifacts rather than the
+    owner-only ones of the temporary file.
+    """
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=cache_file.parent, prefix=cache_file.name, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+
+def _decode_json_response(response: "requests.Response") -> str:
+    """Decode a json response with the charset declared in its headers if any.
+
+    Otherwise follow the json specification (UTF-8, 16 or 32).
+    """
+    content_type = response.headers.get("Content-Type", "").lower()
+    if "charset=" in content_type and response.encoding:
+        return response.content.decode(response.encoding)
+    return response.content.decode(json.detect_encoding(response.content))
+
+
+def get_url_cached(url: str, cache_file: Path, ttl: int = URL_CACHE_TTL) -> str:
+    """Return the json text content of ``url``, using an on-disk cache keyed by URL.
+
+    The content is decoded with the charset declared by the server, or else
+    following the json specification rather than with the character set
+    detection of ``requests``.
+
+    Entries younger than ``ttl`` seconds are returned without any network access.
+    Older entries are revalidated with ``If-None-Match``/``If-Modified-Since``
+    and reused if the server answers ``304 Not Modified``. Only content that
+    parses as json is cached. Network errors are raised as ``requests``
+    exceptions, the cache is never a reason to fail.
+    """
+    cache = _read_url_cache(cache_file)
+
+    now = time.time()
+    entry = cache.get(url)
+    if entry and now - entry["fetched_at"] < ttl:
+        return entry["body"]
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = _get_session().get(url, headers=headers, timeout=5)
+    if entry and response.status_code == 304:
+        entry["fetched_at"] = now
+    else:
+        response.raise_for_status()
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body": _decode_json_response(response),
+            "fetched_at": now,
+        }
+
+    # don't keep serving a body that is not json (e.g. an error page from a proxy)
+    try:
+        json.loads(entry["body"])
+    except ValueError:
+        cache.pop(url, None)
+    else:
+        cache[url] = entry
+    _write_url_cache(cache_file, cache)
+
+    return entry["body"]
@@ -778,6 +778,18 @@ def test_version_switcher_error_states(
             switcher.prettify(), basename="navbar_switcher", extension=".html"
         )
 
+        # the page metadata is set in a single inline script
+        options = index.find_all("script", string=re.compile("DOCUMENTATION_OPTIONS"))
+        assert len(options) == 1
+        assert "DOCUMENTATION_OPTIONS.pagename = 'index';" in options[0].string
+        assert "show_version_warning_banner = false;" in options[0].string
+
+        # the switcher metadata is shared by all the pages in a static file
+        static_js = "_static/scripts/pydata-sphinx-theme-switcher.js"
+        assert index.find("script", src=re.compile(re.escape(static_js)))
+        switcher_js = (sphinx_build.outdir / static_js).read_text()
+        assert "theme_switcher_version_match = '0.7.1';" in switcher_js
+
     elif url == "http://a.b/switcher.json":  # this file doesn't exist"
         not_read = 'WARNING: The version switcher "http://a.b/switcher.json" file cannot be read due to the following error:\n'
         assert not_read in escape_ansi(sphinx_build.warnings).strip()
@@ -787,6 +799,22 @@ def test_version_switcher_error_states(
         assert escape_ansi(sphinx_build.warnings).strip() == missing_url
 
 
+def test_version_switcher_parallel(sphinx_build_factory) -> None:
+    """The remote switcher file is read before parallel builds fork their workers."""
+    confoverrides = {
+        "html_theme_options": {
+            "switcher": {
+                "json_url": "http://a.b/switcher.json",
+                "version_match": "0.7.1",
+            },
+        }
+    }
+    # the warning is already there before the build starts
+    sphinx_build = sphinx_build_factory("base", confoverrides=confoverrides, parallel=2)
+    not_read = 'WARNING: The version switcher "http://a.b/switcher.json" file cannot be read due to the following error:\n'
+    assert not_read in escape_ansi(sphinx_build.warnings).strip()
+
+
 def test_theme_switcher(sphinx_build_factory, file_regression) -> None:
     """Regression test for the theme switcher button."""
     sphinx_build = sphinx_build_factory("base").build()
@@ -933,6 +961,23 @@ def test_empty_templates(sphinx_build_factory) -> None:
     assert not html.select(".navbar-icon-links")
 
 
+def test_empty_templates_cache(sphinx_build_factory) -> None:
+    """The emptiness of a template is not reused on pages where it differs."""
+    # the template only depends on `pagename` through the template it includes
+    confoverrides = {
+        "templates_path": ["_templates_page_dependent"],
+        "html_theme_options.navigation_with_keys": False,
+        "html_theme_options.footer_center": ["page1-only"],
+    }
+    sphinx_build = sphinx_build_factory("base", confoverrides=confoverrides).build()
+
+    for page in ["index.html", "page1.html", "page2.html", "section1/index.html"]:
+        html = sphinx_build.html_tree(page)
+        is_page1 = page == "page1.html"
+        assert bool(html.select(".footer-items__center .page1-only")) is is_page1
+        assert bool(html.select(".footer-items__center")) is is_page1
+
+
 def test_translations(sphinx_build_factory) -> None:
     """Test that basic translation functionality works.
 
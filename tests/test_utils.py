@@ -0,0 +1,138 @@
+"""Tests for the helpers of the utils module."""
+
+import json
+import os
+import stat
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pytest
+
+from pydata_sphinx_theme import utils
+
+URL = "https://example.com/switcher.json"
+BODY = '[{"version": "1.0", "url": "https://example.com/1.0/"}]'
+
+
+class FakeResponse:
+    """Minimal stand-in for a ``requests.Response``."""
+
+    def __init__(
+        self,
+        status_code: int,
+        body: str = "",
+        headers: Optional[dict] = None,
+        encoding: Optional[str] = None,
+    ):
+        self.status_code = status_code
+        self.content = body.encode(encoding or "utf-8")
+        self.headers = headers or {}
+        self.encoding = encoding
+
+    def raise_for_status(self) -> None:
+        """Raise for error status codes like ``requests`` does."""
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """Session returning canned responses and recording the requests made."""
+
+    def __init__(self, *responses: FakeResponse):
+        self.responses = list(responses)
+        self.requests: List[Dict[str, str]] = []
+
+    def get(self, url: str, headers: Dict[str, str], timeout: int) -> FakeResponse:
+        """Record the request headers and return the next canned response."""
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+@pytest.fixture()
+def session(monkeypatch) -> FakeSession:
+    """Replace the shared HTTP session by a fake one."""
+    fake = FakeSession()
+    monkeypatch.setattr(utils, "_get_session", lambda: fake)
+    return fake
+
+
+def write_cache(cache_file: Path, fetched_at: float) -> None:
+    """Write a cache file with a single entry for ``URL``."""
+    entry = {
+        "etag": '"abc"',
+        "last_modified": "Mon, 02 Oct 2023 10:00:00 GMT",
+        "body": BODY,
+        "fetched_at": fetched_at,
+    }
+    cache_file.write_text(json.dumps({URL: entry}))
+
+
+def test_url_cache_fresh_entry(tmp_path: Path, session: FakeSession) -> None:
+    """A fresh entry is served without any request."""
+    cache_file = tmp_path / "cache.json"
+    write_cache(cache_file, time.time())
+
+    assert utils.get_url_cached(URL, cache_file) == BODY
+    assert session.requests == []
+
+
+def test_url_cache_revalidation(tmp_path: Path, session: FakeSession) -> None:
+    """A stale entry is revalidated and its body reused on 304."""
+    cache_file = tmp_path / "cache.json"
+    write_cache(cache_file, time.time() - 2 * utils.URL_CACHE_TTL)
+    session.responses.append(FakeResponse(304))
+
+    assert utils.get_url_cached(URL, cache_file) == BODY
+    assert session.requests == [
+        {
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Mon, 02 Oct 2023 10:00:00 GMT",
+        }
+    ]
+
+    # the entry is fresh again
+    entry = json.loads(cache_file.read_text())[URL]
+    assert time.time() - entry["fetched_at"] < utils.URL_CACHE_TTL
+
+
+@pytest.mark.parametrize(
+    "content", ["not json", "[1, 2]", json.dumps({URL: {"body": BODY}})]
+)
+def test_url_cache_corrupted(tmp_path: Path, session: FakeSession, content) -> None:
+    """A corrupted cache file falls back to a normal fetch."""
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text(content)
+    session.responses.append(FakeResponse(200, BODY, {"ETag": '"def"'}))
+
+    assert utils.get_url_cached(URL, cache_file) == BODY
+    assert session.requests == [{}]
+    assert json.loads(cache_file.read_text())[URL]["etag"] == '"def"'
+
+
+def test_url_cache_not_json(tmp_path: Path, session: FakeSession) -> None:
+    """A body that is not json is returned but not cached."""
+    cache_file = tmp_path / "cache.json"
+    session.responses.append(FakeResponse(200, "<html>Bad gateway</html>"))
+
+    assert utils.get_url_cached(URL, cache_file) == "<html>Bad gateway</html>"
+    assert URL not in json.loads(cache_file.read_text())
+
+
+def test_url_cache_declared_charset(tmp_path: Path, session: FakeSession) -> None:
+    """The charset declared by the server is used to decode the body."""
+    body = '[{"version": "1.0 (été)", "url": "https://example.com/1.0/"}]'
+    headers = {"Content-Type": "application/json; charset=iso-8859-1"}
+    session.responses.append(FakeResponse(200, body, headers, "iso-8859-1"))
+
+    assert utils.get_url_cached(URL, tmp_path / "cache.json") == body
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX file permissions")
+def test_url_cache_file_mode(tmp_path: Path, session: FakeSession) -> None:
+    """The cache file follows the umask like the other build artifacts."""
+    cache_file = tmp_path / "cache.json"
+    session.responses.append(FakeResponse(200, BODY))
+
+    utils.get_url_cached(URL, cache_file)
+    assert stat.S_IMODE(cache_file.stat().st_mode) == 0o666 & ~utils._UMASK